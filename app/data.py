@@ -1,10 +1,17 @@
+import hashlib
 import logging
 import os
-import random
+import threading
+import time
 
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime as dt
 from datetime import timezone as tz
-from functools import cache
+from functools import cache, lru_cache, wraps
+from itertools import chain
+from operator import itemgetter
+from typing import AbstractSet, Any, Callable, Iterable, Iterator, Protocol, TypeVar, cast
 from model import Activity, SourceInfo, StatsScope, StatsType
 
 from google.oauth2 import service_account
@@ -13,11 +20,57 @@ from googleapiclient.discovery import build
 
 logger = logging.getLogger("uvicorn.error")
 
-cluster_sheet_id = os.environ.get("CLUSTER_SHEET_ID")
-nbhd_sheet_id = os.environ.get("NBHD_SHEET_ID")
-nbhd_source_tab = os.environ.get("NBHD_SOURCE_TAB")
+T = TypeVar("T")
+T_co = TypeVar("T_co", covariant=True)
+
+# background refreshes for stale cache entries are run one at a time on this executor
+_refresh_executor = ThreadPoolExecutor(max_workers=1)
+# per-thread state, see `_sheets_service`
+_thread_local = threading.local()
+
+
+def _require_env(name: str) -> str:
+    """Read a required environment variable, failing at import time if it is missing or empty."""
+    value = os.environ.get(name)
+    if not value:
+        raise RuntimeError(f"{name} is empty, the env variable must be set.")
+    return value
+
+
+cluster_sheet_id = _require_env("CLUSTER_SHEET_ID")
+nbhd_sheet_id = _require_env("NBHD_SHEET_ID")
+nbhd_source_tab = _require_env("NBHD_SOURCE_TAB")
+# keyfile on the host, specified in the .env file, is mapped to /sheets-key.json in the container
+sheets_key_file = "/sheets-key.json"
 last_cluster_data_dt = dt.min
 last_nbhd_data_dt = dt.min
+# maps keys to (data table, structure derived from it), see `_derive`
+_derived: dict[str, tuple[list, Any]] = {}
+
+# Maps activities to the row offset of their "number of activities" cell in the reformatted data tables.  The
+# "number of participants" cell immediately follows it.
+_OFFSETS = {
+    Activity.DG: 4,
+    Activity.CC: 6,
+    Activity.JY: 8,
+    Activity.SC: 10,
+}
+
+# Maps three-letter month abbreviations to ISO month numbers, see `_iso_date`
+_MONTHS = {
+    "Jan": "01",
+    "Feb": "02",
+    "Mar": "03",
+    "Apr": "04",
+    "May": "05",
+    "Jun": "06",
+    "Jul": "07",
+    "Aug": "08",
+    "Sep": "09",
+    "Oct": "10",
+    "Nov": "11",
+    "Dec": "12",
+}
 
 nbhd_cluster_groups = {
     "Abbotsford-Mission": "LM East",
@@ -83,6 +136,18 @@ cluster_groups = {
     "BC41 - Haida Gwaii": "Interior North",
 }
 
+
+def _invert(mapping: dict[str, str]) -> dict[str, frozenset[str]]:
+    """Invert a mapping of areas to groups into a mapping of groups to the areas in each group."""
+    inverse = defaultdict(set)
+    for area, group in mapping.items():
+        inverse[group].add(area)
+    return {group: frozenset(areas) for group, areas in inverse.items()}
+
+
+# maps cluster groups to the clusters in each group
+cluster_groups_inverse = _invert(cluster_groups)
+
 # This object maps tab names in the cluster spreadsheet to column indexes representing the start of the table 2 data.
 # For example, the value at index 46 corresponds to column AU in the spreadsheet, which represents the start of
 # table 2.  So in that table, data[46] is nDG, data[47] is pDG, data[49] is nCC, data[50] is pCC, ..., where
@@ -105,6 +170,103 @@ cluster_source_tabs = {
 }
 
 
+class _SwrCached(Protocol[T_co]):
+    """A function decorated with `swr_cache`."""
+
+    def __call__(self, *args: Any) -> T_co: ...
+
+    def cache_clear(self) -> None: ...
+
+
+def swr_cache(ttl: float = 300, rewarm: float = 60) -> Callable[[Callable[..., T]], _SwrCached[T]]:
+    """Cache a function's results with stale-while-revalidate semantics.
+
+    Results younger than `rewarm` seconds are returned as-is.  Results between `rewarm` and `ttl` seconds old are
+    returned immediately while a fresh copy is computed in the background.  Results older than `ttl` seconds are
+    recomputed before returning.  Concurrent refreshes of the same entry are coalesced into one.  Like
+    `functools.cache`, the decorated function gets a `cache_clear()` method.
+
+    Args:
+        ttl (float): Age in seconds after which a cached result is no longer served.
+        rewarm (float): Age in seconds after which a cached result is refreshed in the background.
+    """
+
+    def decorator(func: Callable[..., T]) -> _SwrCached[T]:
+        entries: dict[tuple, tuple] = {}  # maps args to (value, fetched_at)
+        locks: dict[tuple, threading.Lock] = {}
+        # `cache_clear` bumps the generation so that results computed before the clear are never stored
+        generation = 0
+        state_lock = threading.Lock()
+
+        def store(key: tuple, value, started_generation: int):
+            with state_lock:
+                if started_generation == generation:
+                    entries[key] = (value, time.monotonic())
+
+        def refresh(key: tuple, started_generation: int):
+            try:
+                store(key, func(*key), started_generation)
+            except Exception:
+                logger.exception(f"Background refresh of {func.__name__} failed, serving stale data.")
+            finally:
+                locks[key].release()
+
+        @wraps(func)
+        def wrapper(*args):
+            lock = locks.setdefault(args, threading.Lock())
+            entry = entries.get(args)
+            if entry is not None:
+                value, fetched_at = entry
+                age = time.monotonic() - fetched_at
+                if age < rewarm:
+                    return value
+                if age < ttl:
+                    if lock.acquire(blocking=False):
+                        # the lock is released by `refresh` once the new value is stored
+                        _refresh_executor.submit(refresh, args, generation)
+                    return value
+            with lock:
+                entry = entries.get(args)
+                if entry is not None and time.monotonic() - entry[1] < rewarm:
+                    # another caller refreshed the entry while we were waiting for the lock
+                    return entry[0]
+                started_generation = generation
+                value = func(*args)
+                store(args, value, started_generation)
+                return value
+
+        def cache_clear():
+            nonlocal generation
+            with state_lock:
+                generation += 1
+                entries.clear()
+
+        cached = cast(_SwrCached[T], wrapper)
+        cached.cache_clear = cache_clear
+        return cached
+
+    return decorator
+
+
+def _sheets_service():
+    """Get the calling thread's Sheets API client, building it on first use.
+
+    The client's httplib2 transport isn't thread-safe, so each thread (e.g. the request handlers and the background
+    cache refresh) gets its own client rather than sharing one.
+
+    Return:
+        The `spreadsheets()` resource of the Sheets API client.
+    """
+    sheet = getattr(_thread_local, "sheet", None)
+    if sheet is None:
+        scopes: list = ["https://www.googleapis.com/auth/spreadsheets"]
+        creds = service_account.Credentials.from_service_account_file(sheets_key_file, scopes=scopes)
+        service = build("sheets", "v4", credentials=creds, cache_discovery=False, static_discovery=True)
+        sheet = service.spreadsheets()
+        _thread_local.sheet = sheet
+    return sheet
+
+
 def _get_data(sheet_id: str, source_tab: str, range: str = "A1:ZZ") -> list[list[str]]:
     """Retrieve data from a source spreadsheet.
 
@@ -115,69 +277,118 @@ def _get_data(sheet_id: str, source_tab: str, range: str = "A1:ZZ") -> list[list
     Return:
         The data table as a list of rows.
     """
-    scopes: list = ["https://www.googleapis.com/auth/spreadsheets"]
-    # keyfile on the host, specified in the .env file, is mapped to /sheets-key.json in the container
-    creds = service_account.Credentials.from_service_account_file("/sheets-key.json", scopes=scopes)
-    service = build("sheets", "v4", credentials=creds)
-    sheet = service.spreadsheets()
+    sheet = _sheets_service()
     return sheet.values().get(spreadsheetId=sheet_id, range=f"'{source_tab}'!{range}").execute()["values"]
 
 
-def compute_data_point(row: list, activities: set[Activity], type: StatsType) -> int | None:
+def _get_data_batch(sheet_id: str, ranges: list[str], value_render_option: str = "FORMATTED_VALUE") -> list[list[list]]:
+    """Retrieve several ranges of data from a source spreadsheet in a single request.
+
+    Args:
+        sheet_id (str): The spreadsheet document ID (taken from the URL).
+        ranges (list): The ranges of data to retrieve in A1 notation, including the tab name.
+        value_render_option (str): How the Sheets API should render cell values, e.g. "UNFORMATTED_VALUE" to get
+            numbers back as numbers instead of formatted strings.
+    Return:
+        A list of data tables in the same order as `ranges`, each as a list of rows.
+    """
+    sheet = _sheets_service()
+    request = sheet.values().batchGet(spreadsheetId=sheet_id, ranges=ranges, valueRenderOption=value_render_option)
+    response = request.execute()
+    # value ranges are returned in the order they were requested; empty ranges have no "values" key
+    return [value_range.get("values", []) for value_range in response["valueRanges"]]
+
+
+def _column_letter(index: int) -> str:
+    """Convert a zero-based column index to a spreadsheet column name, e.g. 0 to "A" and 46 to "AU"."""
+    name = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        name = chr(ord("A") + remainder) + name
+    return name
+
+
+def _iso_date(month: str, year: str) -> str:
+    """Convert a month and year from a spreadsheet header, e.g. "Jan" or "JANUARY" and "2019", to an ISO date
+    string for the first of that month, e.g. "2019-01-01".  Raises ValueError if the date isn't recognized."""
+    month_number = _MONTHS.get(month[:3].title())
+    if month_number is None or len(year) != 4 or not year.isdecimal():
+        raise ValueError(f"Unrecognized date '{month} {year}', expected a month name and a four-digit year.")
+    return f"{year}-{month_number}-01"
+
+
+def _parse_count(cell: str | int | float) -> int | None:
+    """Parse a count from a spreadsheet cell, e.g. "1,234" to 1234.  Returns None if the cell isn't a non-negative
+    whole number."""
+    if isinstance(cell, bool):
+        # checkbox cells come back as booleans, which would otherwise pass as ints
+        return None
+    # unformatted values come back from the Sheets API as numbers already
+    if isinstance(cell, int):
+        return cell if cell >= 0 else None
+    if isinstance(cell, float):
+        return int(cell) if cell >= 0 and cell.is_integer() else None
+    count = cell.replace(",", "")
+    return int(count) if count.isdecimal() else None
+
+
+@cache
+def _offsets_for(activities: frozenset[Activity], type: StatsType) -> tuple[int, ...]:
+    """Get the row offsets of the cells to sum up for the given activities and stats type."""
+    return tuple(_OFFSETS[activity] + type for activity in activities)
+
+
+def compute_data_point(row: list, activities: AbstractSet[Activity], type: StatsType) -> int | None:
     """Compute a data point for an area based on a CGP-style table row as returned by
     get_neighbourhood_data and get_cluster_data.
 
     Args:
         row (list): a row from the table returned by get_neighbourhood_data.
-        activities (set): the activities to sum up into this data point.
+        activities (AbstractSet): the activities to sum up into this data point, as a set or frozenset.
         type (StatsType): Indicate whether to sum up numbers of activities or participants.
     Return:
         The sum of activities or participants for the specified activities.  If the sum is 0 then 0 is returned,
         but if there are no data points for the given activities then None is returned.
     """
-    cell_values = []
-    if Activity.DG in activities:
-        cell_values.append(row[4 + type])
-    if Activity.CC in activities:
-        cell_values.append(row[6 + type])
-    if Activity.JY in activities:
-        cell_values.append(row[8 + type])
-    if Activity.SC in activities:
-        cell_values.append(row[10 + type])
-    values = [int(x.replace(",", "")) for x in cell_values if x != ""]
-    if len(values) == 0:
-        return None
-    return sum(values)
+    total = 0
+    found = False
+    for offset in _offsets_for(frozenset(activities), type):
+        value = row[offset]
+        if value is not None:
+            total += value
+            found = True
+    return total if found else None
 
 
 @cache
+def _get_sheet_properties(sheet_id: str) -> tuple[str, str]:
+    """Get the title and URL of a spreadsheet.  The cache is cleared each time the source data are pulled."""
+    sheet = _sheets_service().get(spreadsheetId=sheet_id).execute()
+    return (sheet.get("properties").get("title"), sheet.get("spreadsheetUrl"))
+
+
 def get_source_info(scope: StatsScope) -> SourceInfo:
     """Get the title, URL, and last update timestamp of the spreadsheet used as a data source for the given scope.
 
-    The cache for this function needs to be cleared any time the source data get updated."""
-    global last_cluster_data_dt, last_nbhd_data_dt
+    The title and URL are cached until the next pull of the source data; the timestamp always reflects the most
+    recent successful pull."""
     sheet_id = cluster_sheet_id if scope == StatsScope.CLUSTER else nbhd_sheet_id
-    scopes: list = ["https://www.googleapis.com/auth/spreadsheets"]
-    creds = service_account.Credentials.from_service_account_file("/sheets-key.json", scopes=scopes)
-    service = build("sheets", "v4", credentials=creds)
-    sheet = service.spreadsheets().get(spreadsheetId=sheet_id).execute()
-    title = sheet.get("properties").get("title")
-    url = sheet.get("spreadsheetUrl")
+    title, url = _get_sheet_properties(sheet_id)
     last_pulled_dt = last_cluster_data_dt if scope == StatsScope.CLUSTER else last_nbhd_data_dt
     return SourceInfo(title=title, url=url, last_pulled=last_pulled_dt)
 
 
-@cache
+@lru_cache(maxsize=1024)
 def get_colour_from_name(name: str, offset: int = 0) -> tuple[str, str]:
     """Compute a background colour and a border colour from an arbitrary string.
 
-    The colour is derived randomly using the `name` parameter as a seed.  This means that the colour assigned
-    to a given area is random but consistent.  We do this because the default chart.js colour palette is limited.
-    Each RGB channel in the bgColour is assigned a random value between 30 and 200; the borderColour is the same
+    The colour is derived from a hash of the `name` parameter.  This means that the colour assigned to a given
+    area is arbitrary but consistent.  We do this because the default chart.js colour palette is limited.
+    Each RGB channel in the bgColour is assigned a value between 30 and 200; the borderColour is the same
     but with +50 added across all 3 channels---in other words, the effective line colours can range from
     rgb(80, 80, 80) to rgb(250, 250, 250).  An additional offset can be specified, e.g. to generate a line that
-    matches a given area's hue but is brighter or darker than the default.  The PRNG is re-seeded with the current
-    time after the colour is generated.
+    matches a given area's hue but is brighter or darker than the default.
 
     Args:
         name (str): A cluster or neighbourhood name (or any string) used to seed the generation of a colour.
@@ -190,16 +401,16 @@ def get_colour_from_name(name: str, offset: int = 0) -> tuple[str, str]:
     """
     # This is a little silly and might need some tweaking to get good colours.  There's also plugins for chart.js
     # that expand its default colour palette---might be worth exploring if this doesn't work out.
-    random.seed(name)
-    [r, g, b] = [random.randrange(30, 200) + offset for _ in range(0, 3)]
-    random.seed()
+    h = hashlib.blake2b(name.encode(), digest_size=3).digest()
+    [r, g, b] = [30 + h[i] % 170 + offset for i in range(0, 3)]
     return (f"rgb({r}, {g}, {b})", f"rgb({r+50}, {g+50}, {b+50})")
 
 
-@cache
-def get_cluster_data() -> list[list[str]]:
+@swr_cache(ttl=300, rewarm=60)
+def get_cluster_data() -> list[list[str | int | None]]:
     """Retrieve cluster statistical data from the source spreadsheet and reformat it to look more like the output
-    of `get_neighbourhood_data`.  Data rows with no activities are excluded, and empty cells have a value of "".
+    of `get_neighbourhood_data`.  Data rows with no activities are excluded.  Counts are parsed to ints, and empty
+    cells have a value of None.
     While the spreadsheets indicate dates (presumably corresponding to )
 
     Return:
@@ -211,46 +422,61 @@ def get_cluster_data() -> list[list[str]]:
     """
     global last_cluster_data_dt
     logger.info("Retrieving fresh cluster data.")
-    last_cluster_data_dt = dt.now(tz=tz.utc)
-    get_source_info.cache_clear()
-    if cluster_sheet_id is None:
-        logger.error("CLUSTER_SHEET_ID is empty, the env variables must be set.")
-        return []
     new_rows = []
-    for tab_name in cluster_source_tabs:
+    ranges = []
+    for tab_name, start_column in cluster_source_tabs.items():
+        # only pull the cluster names in column B and the eleven table 2 columns we use
+        ranges.append(f"'{tab_name}'!B1:B")
+        ranges.append(f"'{tab_name}'!{_column_letter(start_column)}1:{_column_letter(start_column + 10)}")
+    tables = _get_data_batch(cluster_sheet_id, ranges, value_render_option="UNFORMATTED_VALUE")
+    for tab_index, tab_name in enumerate(cluster_source_tabs):
         tokens = tab_name.split()
-        date = f"1 {tokens[0][0:3]} {tokens[1]}"
-        date = dt.strptime(date, "%d %b %Y").isoformat().split("T")[0]
-        start_column = cluster_source_tabs[tab_name]
-        data = _get_data(cluster_sheet_id, tab_name)
-        for row in data[3:]:
-            if len(row) < start_column or not row[1].startswith("BC"):
+        date = _iso_date(tokens[0], tokens[1])
+        names = tables[2 * tab_index]
+        data = tables[2 * tab_index + 1]
+        for name_row, row in zip(names[3:], data[3:]):
+            name = name_row[0] if name_row else ""
+            if not row or not isinstance(name, str) or not name.startswith("BC"):
                 # this row doesn't hold cluster data
                 continue
             # some older tables have "R" included in the cluster names to indicate a reservoir cluster--remove it.
-            cluster = row[1].replace('"R"', "").strip()
+            cluster = name.replace('"R"', "").strip()
             if cluster not in cluster_groups:
                 logger.error(f"Cluster '{cluster}' listed in tab `{tab_name}` was not in the list of known clusters.")
                 continue
+            if len(row) < 11:
+                # the Sheets API omits trailing empty cells
+                row = row + [""] * (11 - len(row))
             cluster_group = cluster_groups[cluster]
-            new_row = [cluster_group, cluster, "", date]  # third entry is nbhd, which we ignore in this view.
+            # third entry is nbhd, which we ignore in this view.
+            new_row: list[str | int | None] = [cluster_group, cluster, "", date]
+            has_data = False
             for i in range(0, 11, 3):
                 # Assumes the source data is structured like table 2 from the CGP.  Each core activity has three
-                # columns, starting at `start_column` which is specified on a tab-by-tab basis above.  For each core
-                # activity, we extract the first two of its columns (number of the activity and number of participants)
-                # into the new row.
-                new_row.append(row[start_column + i])
-                new_row.append(row[start_column + i + 1])
-            if "".join(new_row[4:]):
+                # columns, and the range fetched above starts at `start_column` which is specified on a tab-by-tab
+                # basis.  For each core activity, we extract the first two of its columns (number of the activity and
+                # number of participants) into the new row.
+                num = _parse_count(row[i])
+                participants = _parse_count(row[i + 1])
+                new_row.append(num)
+                new_row.append(participants)
+                if num is not None or participants is not None:
+                    has_data = True
+            if has_data:
                 # only add the row if there's at least one data point
                 new_rows.append(new_row)
+    # only record the pull time once the fetch has succeeded, since a failed refresh keeps serving the old data
+    last_cluster_data_dt = dt.now(tz=tz.utc)
+    # pick up any change to the sheet's title or URL along with the new data
+    _get_sheet_properties.cache_clear()
     return new_rows
 
 
-@cache
-def get_neighbourhood_data() -> list[list]:
+@swr_cache(ttl=300, rewarm=60)
+def get_neighbourhood_data() -> list[list[str | int | None]]:
     """Retrieve neighbourhood statistical data from the source spreadsheet and reformat it to look more like
-    a cluster growth profile table.  Data rows with no activities are excluded, and empty cells have a value of "".
+    a cluster growth profile table.  Data rows with no activities are excluded.  Counts are parsed to ints, and
+    empty cells have a value of None.
 
     Return:
         The reformatted data table.  Table headers look like this:
@@ -261,47 +487,125 @@ def get_neighbourhood_data() -> list[list]:
     """
     logger.info("Retrieving fresh neighbourhood data.")
     global last_nbhd_data_dt
-    last_nbhd_data_dt = dt.now(tz=tz.utc)
-    get_source_info.cache_clear()
-    if nbhd_sheet_id is None or nbhd_source_tab is None:
-        logger.error("NBHD_SHEET_ID and/or NBHD_SOURCE_TAB is empty, both env variables must be set.")
-        return []
     data = _get_data(nbhd_sheet_id, nbhd_source_tab)
 
     # pull dates out of the sheet and reformat to ISO format e.g. "Jan     2019" to "2019-01-01"
-    dates = {}
-    for i in range(0, len(data[2])):
+    dates = defaultdict(list)
+    for i, cell in enumerate(data[2]):
         # build a map from dates to four column numbers for each date
-        if data[2][i]:
-            tokens = data[2][i].split()
-            if len(tokens) != 2:
-                # we're done with the main tables at this point
-                break
-            date = f"1 {tokens[0][0:3]} {tokens[1]}"
-            date = dt.strptime(date, "%d %b %Y").isoformat().split("T")[0]
-            if date not in dates:
-                dates[date] = []
-            dates[date].append(i)
-    dates = {k: dates[k] for k in dates if len(dates[k]) >= 4}  # remove dates that aren't in the four CA subtables
-    new_table = []
-    for row in data[4:]:
-        if not row[0]:
-            # empty cluster name means the end of the data
+        if not cell:
+            continue
+        tokens = cell.split()
+        if len(tokens) != 2:
+            # we're done with the main tables at this point
             break
-        for date in dates:
-            cluster = row[0].strip()
-            nbhd = row[1].strip()
-            if cluster not in nbhd_cluster_groups:
-                logger.error(f"Cluster {cluster} is not in the mapping of clusters to cluster groups.")
-                group = ""
-            else:
-                group = nbhd_cluster_groups[cluster]
-            new_row = [group, cluster, nbhd]
-            new_row.append(date)
-            for i in range(0, 4):
-                new_row.append(row[dates[date][i]] if row[dates[date][i]].isdecimal() else "")
-                new_row.append(row[dates[date][i] + 1] if row[dates[date][i] + 1].isdecimal() else "")
-            if "".join(new_row[4:]):
+        dates[_iso_date(tokens[0], tokens[1])].append(i)
+    # remove dates that aren't in the four CA subtables, and flatten each remaining date's four activity columns
+    # into (number, participants) column pairs
+    flat_dates = {k: tuple(c + j for c in v[:4] for j in (0, 1)) for k, v in dates.items() if len(v) >= 4}
+    # itemgetter does the per-date gather in C; the row is padded below so every column index is valid
+    gathers = [(date, itemgetter(*flat_cols)) for date, flat_cols in flat_dates.items()]
+    width = max((max(flat_cols) for flat_cols in flat_dates.values()), default=-1) + 1
+    new_table = []
+    seen_missing = set()
+    rows = data[4:]
+    # an empty cluster name means the end of the data
+    n = next((i for i, r in enumerate(rows) if not r or not r[0]), len(rows))
+    for row in rows[:n]:
+        cluster = row[0].strip()
+        # rows can be as short as a single cell since the Sheets API omits trailing empty cells
+        nbhd = row[1].strip() if len(row) > 1 else ""
+        group = nbhd_cluster_groups.get(cluster, "")
+        if not group and cluster not in seen_missing:
+            logger.error(f"Cluster {cluster} is not in the mapping of clusters to cluster groups.")
+            seen_missing.add(cluster)
+        if len(row) < width:
+            # the Sheets API omits trailing empty cells
+            row = row + [""] * (width - len(row))
+        for date, gather in gathers:
+            new_row: list[str | int | None] = [group, cluster, nbhd, date]
+            values = [_parse_count(c) for c in gather(row)]
+            new_row.extend(values)
+            if any(v is not None for v in values):
                 # only add the row if there's at least one data point
                 new_table.append(new_row)
+    # only record the pull time once the fetch has succeeded, since a failed refresh keeps serving the old data
+    last_nbhd_data_dt = dt.now(tz=tz.utc)
+    # pick up any change to the sheet's title or URL along with the new data
+    _get_sheet_properties.cache_clear()
     return new_table
+
+
+def get_rows_for_names(scope: StatsScope, data: list[list], names: Iterable[str]) -> Iterator[list]:
+    """Get the data rows for the given clusters or neighbourhoods.
+
+    Rows are looked up in an index from area names to rows, which is built once per data table.
+
+    Args:
+        scope (StatsScope): Whether `names` are cluster or neighbourhood names.
+        data (list): The data table for `scope`, as returned by get_cluster_data or get_neighbourhood_data.
+        names (Iterable): The names of the areas to get rows for.  Unknown names are ignored.
+    Return:
+        An iterator over the matching rows of the table returned by get_cluster_data or get_neighbourhood_data,
+        grouped by area in the order given by `names`.
+    """
+    if scope == StatsScope.NEIGHBOURHOOD:
+        index = _derive("nbhd_name_index", data, lambda data: _build_name_index(data, 2))
+    else:
+        index = _derive("cluster_name_index", data, lambda data: _build_name_index(data, 1))
+    return chain.from_iterable(index[name] for name in names if name in index)
+
+
+def derive_from_data(scope: StatsScope, key: str, builder: Callable[[list[list]], T]) -> T:
+    """Get a structure tied to the data table for the given scope, rebuilding it whenever the table is refreshed.
+
+    Args:
+        scope (StatsScope): The scope of the data table the structure depends on.
+        key (str): A unique name for the structure.
+        builder (Callable): Builds a fresh copy of the structure from the current data table.
+    Return:
+        The structure built for the current data table.
+    """
+    data = get_neighbourhood_data() if scope == StatsScope.NEIGHBOURHOOD else get_cluster_data()
+    return _derive(f"{scope.value}_{key}", data, builder)
+
+
+def _build_name_index(data: list[list], name_column: int) -> dict[str, list[list]]:
+    """Build an index from the area names in the given column of a data table to the rows for that area."""
+    index = defaultdict(list)
+    for row in data:
+        index[row[name_column]].append(row)
+    return dict(index)
+
+
+def get_neighbourhood_tree() -> dict[str, dict[str, set[str]]]:
+    """Get a mapping of cluster groups to mappings of clusters to the neighbourhoods in the cluster.
+
+    The mapping is rebuilt whenever the neighbourhood data are refreshed, and must not be modified by callers."""
+    return _derive("nbhd_tree", get_neighbourhood_data(), _build_neighbourhood_tree)
+
+
+def _build_neighbourhood_tree(data: list[list]) -> dict[str, dict[str, set[str]]]:
+    """Build the mapping returned by get_neighbourhood_tree from the neighbourhood data table."""
+    tree: dict[str, dict[str, set[str]]] = {}
+    for row in data:
+        tree.setdefault(row[0], {}).setdefault(row[1], set()).add(row[2])
+    return tree
+
+
+def _derive(key: str, data: list[list], builder: Callable[[list[list]], T]) -> T:
+    """Get a structure derived from a data table, rebuilding it only if the table was refreshed since the last call.
+
+    Args:
+        key (str): A unique name for the derived structure.
+        data (list): The current data table, as returned by get_cluster_data or get_neighbourhood_data.
+        builder (Callable): Builds the derived structure from the data table.
+    Return:
+        The derived structure.
+    """
+    cached = _derived.get(key)
+    if cached is None or cached[0] is not data:
+        # the cache returns a new table object on every refresh
+        cached = (data, builder(data))
+        _derived[key] = cached
+    return cached[1]
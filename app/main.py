@@ -1,21 +1,29 @@
 #!/usr/bin/env python3
 
 import logging
+import orjson
 import os
 
+from functools import lru_cache, partial
+from operator import itemgetter
+
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import HTMLResponse, ORJSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 
 from data import (
-    cluster_groups,
+    cluster_groups_inverse,
     compute_data_point,
+    derive_from_data,
     get_cluster_data,
     get_colour_from_name,
     get_neighbourhood_data,
+    get_neighbourhood_tree,
+    get_rows_for_names,
     get_source_info,
 )
-from model import Dataset, SourceInfo, StatsRequest, StatsResponse, StatsScope, StatsData
+from model import Activity, Dataset, SourceInfo, StatsRequest, StatsResponse, StatsScope, StatsData, StatsType
 
 description = """Provides statistical data for charting"""
 
@@ -30,8 +38,13 @@ app = FastAPI(
     title="Stats API",
     version="0.2.0",
     description=description,
+    default_response_class=ORJSONResponse,
 )
 
+# Compress larger responses (mostly /stats) for clients that accept it.  Responses are compressed on every request,
+# so use a moderate level rather than Starlette's default of 9.
+app.add_middleware(GZipMiddleware, minimum_size=1000, compresslevel=5)
+
 # Calling the functions to get data from the spreadsheets has the side effect of caching the data locally
 get_neighbourhood_data()
 get_cluster_data()
@@ -39,79 +52,83 @@ get_cluster_data()
 # Serve Javascript in a static mount
 app.mount("/static", StaticFiles(directory="/app/static"), name="static")
 
+# The application page is read once here rather than on every request, so the server needs a restart to pick up
+# changes to index.html.
+with open("static/index.html", "rb") as f:
+    index_html = f.read()
+
 logger.info("Server setup complete.")
 
 
 @app.get("/", response_class=HTMLResponse, tags=["Application"])
 async def get_chart_application() -> HTMLResponse:
     """The root endpoint returns the content of index.html."""
-    with open("static/index.html", "r") as f:
-        html = f.read()
-    return HTMLResponse(html)
+    return HTMLResponse(index_html)
 
 
 @app.get("/list/neighbourhood", tags=["Lists"])
-async def get_neighbourhood_list() -> dict[str, dict[str, set]]:
+def get_neighbourhood_list() -> dict[str, dict[str, set]]:
     """Get a mapping of cluster groups to mappings of clusters to lists of neighbourhoods in the cluster."""
-    data = get_neighbourhood_data()
-    cluster_groups = {}
-    for row in data:
-        if row[0] not in cluster_groups:
-            # add a new cluster group
-            cluster_groups[row[0]] = {}
-        if row[1] not in cluster_groups[row[0]]:
-            # add a new cluster to the group
-            cluster_groups[row[0]][row[1]] = set()
-        cluster_groups[row[0]][row[1]].add(row[2])
-    return cluster_groups
+    return get_neighbourhood_tree()
 
 
 @app.get("/list/cluster", tags=["Lists"])
-async def get_cluster_list() -> dict[str, set]:
+async def get_cluster_list() -> dict[str, frozenset[str]]:
     """Get a mapping of cluster groups to a list of cluster names."""
-    val = {}
-    for cluster, group in cluster_groups.items():
-        if group not in val:
-            val[group] = set()
-        val[group].add(cluster)
-    return val
+    return cluster_groups_inverse
 
 
-@app.post("/stats", tags=["Stats"])
-async def request_stats(request: StatsRequest) -> StatsResponse:
+@app.post("/stats", tags=["Stats"], response_model=StatsResponse)
+def request_stats(request: StatsRequest) -> Response:
     """Return stats and source spreadsheet info for the areas specified in the request object."""
-    if request.scope == StatsScope.NEIGHBOURHOOD:
-        data = get_neighbourhood_data()
-    elif request.scope == StatsScope.CLUSTER:
-        data = get_cluster_data()
-    else:
+    if request.scope not in (StatsScope.NEIGHBOURHOOD, StatsScope.CLUSTER):
         raise HTTPException(status_code=422, detail=f"Invalid scope specified: '{request.scope}'.")
+    # Responses are cached per data table, so refreshing the data starts a new cache.  Each cache builds its
+    # responses from the table it belongs to rather than fetching the table again.
+    stats_json = derive_from_data(
+        request.scope, "stats_json", lambda data: lru_cache(maxsize=256)(partial(_build_stats_json, data))
+    )
+    # de-duplicate the requested names once, keeping their order so the chart legend matches the area list
+    names = tuple(dict.fromkeys(request.names))
+    content = stats_json(request.scope, names, frozenset(request.activities), request.stats_type)
+    # Return a response object directly so FastAPI doesn't re-validate every data point against the response model.
+    return Response(content, media_type="application/json")
+
+
+def _build_stats_json(
+    data: list[list],
+    scope: StatsScope,
+    names: tuple[str, ...],
+    activities: frozenset[Activity],
+    stats_type: StatsType,
+) -> bytes:
+    """Build the serialized /stats response for the given request parameters from the given data table."""
+    get_name = itemgetter(2 if scope == StatsScope.NEIGHBOURHOOD else 1)
+    # maps area names to (stats data, append function for x values, append function for y values)
     results = {}
-    for row in data:
-        name = row[2] if request.scope == StatsScope.NEIGHBOURHOOD else row[1]
-        if name not in request.names:
-            # ignore areas that weren't requested
-            continue
-        if name not in results:
+    for row in get_rows_for_names(scope, data, names):
+        name = get_name(row)
+        result = results.get(name)
+        if result is None:
             colours = get_colour_from_name(name)
             dataset = Dataset(
                 label=name,
-                data=[],
+                x=[],
+                y=[],
                 backgroundColor=colours[0],
                 borderColor=colours[1],
             )
-            results[name] = StatsData(name=name, goal=0, dataset=dataset)
-        results[name].dataset.data.append(
-            {
-                "x": row[3],
-                "y": compute_data_point(row, request.activities, request.stats_type),
-            }
-        )
-    return StatsResponse(source=get_source_info(request.scope), data=list(results.values()))
+            result = (StatsData(name=name, goal=0, dataset=dataset), dataset.x.append, dataset.y.append)
+            results[name] = result
+        _, append_x, append_y = result
+        append_x(row[3])
+        append_y(compute_data_point(row, activities, stats_type))
+    response = StatsResponse(source=get_source_info(scope), data=[result[0] for result in results.values()])
+    return orjson.dumps(response.model_dump())
 
 
 @app.delete("/stats", tags=["Stats"])
-async def refresh_neighbourhood_cache():
+def refresh_neighbourhood_cache():
     """Clear the neighbourhood data cache and retrieve a new copy from the source spreadsheet.  This call
     will block until the new data have been retrieved."""
     get_neighbourhood_data.cache_clear()
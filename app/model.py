@@ -2,7 +2,7 @@ from datetime import datetime as dt
 from enum import Enum
 
 from pydantic import BaseModel, Field
-from typing import Dict, List, Set
+from typing import List, Set
 
 
 class Activity(str, Enum):
@@ -32,9 +32,9 @@ class SourceInfo(BaseModel):
 
 class Dataset(BaseModel):
     label: str = Field(description="Data series label (i.e. the neighbourhood or cluster name).")
-    data: List[Dict[str, str | int]] = Field(
-        description="List of data points formatted suitably for charting with chart.js, "
-        "i.e. [{'x': datestamp, 'y': data_point}, ...]"
+    x: List[str] = Field(description="Datestamps of the data points, in ISO format.")
+    y: List[int | None] = Field(
+        description="Values of the data points, parallel to `x`.  Null where there are no data for a datestamp."
     )
     backgroundColor: str = Field(description="String representation of the background colour to use for this dataset.")
     borderColor: str = Field(description="String representation of the border/line colour to use for this dataset.")
@@ -47,7 +47,7 @@ class StatsData(BaseModel):
 
 
 class StatsRequest(BaseModel):
-    names: List = Field(description="List of clusters/neighbourhoods to get stats for.")
+    names: List[str] = Field(description="List of clusters/neighbourhoods to get stats for.")
     scope: StatsScope = Field(description="Request stats for 'Cluster's or 'Neighbourhood's")
     activities: Set[Activity] = Field(description="List of activity types to include in response.")
     stats_type: StatsType = Field(description="Type of statistics to query (number of activities or participants).")
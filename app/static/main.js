@@ -369,7 +369,11 @@ async function refreshChart() {
           let last_pulled = new Date(json.source.last_pulled)
           // last_pulled.
           sourceText.innerHTML = `Data retrieved from <a href="${json.source.url}" target="_blank">${json.source.title}</a> on ${last_pulled.toLocaleDateString()} at ${last_pulled.toLocaleTimeString()}.`
-          chart.data.datasets = Array.from(json.data, (el) => el.dataset)
+          // datasets come back with parallel x and y arrays, which chart.js needs as a list of {x, y} points
+          chart.data.datasets = Array.from(json.data, ({dataset: {x, y, ...dataset}}) => ({
+              ...dataset,
+              data: x.map((date, i) => ({x: date, y: y[i]}))
+          }))
           chart.update()
     });
 }
\ No newline at end of file